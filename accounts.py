@@ -0,0 +1,72 @@
+from sqlmodel import Session, select
+from sqlalchemy import delete, update
+
+from models import URL, RefreshToken, User
+
+from dotenv import load_dotenv
+import os
+
+import database
+import sharding
+
+load_dotenv()
+
+# Accounts with more URLs than this are deleted in the background
+LARGE_ACCOUNT_URLS = int(os.getenv("LARGE_ACCOUNT_URLS", "10000"))
+DELETE_CHUNK_SIZE = int(os.getenv("DELETE_CHUNK_SIZE", "5000"))
+
+
+# Return bool if the user owns more URLs than LARGE_ACCOUNT_URLS
+def is_large_account(user_id: int, session: Session) -> bool:
+    statement = (
+        select(URL.id).where(URL.user_id == user_id).offset(LARGE_ACCOUNT_URLS).limit(1)
+    )
+    return session.exec(statement).first() is not None
+
+
+# Username a large account is renamed to while its data is deleted. Real
+# usernames are only letters, so it can't clash with one.
+def pending_username(username: str) -> str:
+    return f"{username}#deleting"
+
+
+# Block a large account before its background delete: rename it so logins
+# and tokens for the old username stop working, and drop its refresh tokens.
+# Return bool if this call blocked it, False if another request already did.
+def block_user(user: User, session: Session) -> bool:
+    result = session.execute(
+        update(User)
+        .where(User.id == user.id, User.username == user.username)
+        .values(username=pending_username(user.username))
+    )
+    session.execute(delete(RefreshToken).where(RefreshToken.user_id == user.id))
+    session.commit()
+    return result.rowcount == 1
+
+
+# Delete user and related rows with one DELETE per table. URLs are
+# deleted on the user's shard, the user and tokens on the primary.
+def delete_user_data(user_id: int, session: Session):
+    with sharding.router.session_for(user_id) as url_session:
+        url_session.execute(delete(URL).where(URL.user_id == user_id))
+        url_session.commit()
+
+    session.execute(delete(RefreshToken).where(RefreshToken.user_id == user_id))
+    session.execute(delete(User).where(User.id == user_id))
+    session.commit()
+
+
+# Delete URLs in bounded chunks, then the user. Runs as a background task
+def delete_user_in_chunks(user_id: int):
+    with sharding.router.session_for(user_id) as url_session:
+        while True:
+            chunk = (
+                select(URL.id).where(URL.user_id == user_id).limit(DELETE_CHUNK_SIZE)
+            )
+            result = url_session.execute(delete(URL).where(URL.id.in_(chunk)))
+            url_session.commit()
+            if result.rowcount < DELETE_CHUNK_SIZE:
+                break
+
+    with Session(database.engine) as session:
+        delete_user_data(user_id, session)
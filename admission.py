@@ -0,0 +1,152 @@
+from fastapi import Request
+from fastapi.responses import ORJSONResponse
+
+from collections import OrderedDict
+from dotenv import load_dotenv
+import time
+import os
+
+import database
+import auth
+
+load_dotenv()
+
+# Admission settings. Every admitted request holds a primary DB connection,
+# so admitting more than the pool holds only queues work until the pool
+# timeout. The total defaults to the pool capacity and each group to a share
+# of it, so slow groups can't take every connection.
+MAX_IN_FLIGHT = int(
+    os.getenv(
+        "ADMISSION_MAX_IN_FLIGHT",
+        str(database.POOL_SIZE + database.POOL_MAX_OVERFLOW),
+    )
+)
+ROUTE_LIMITS = {
+    "redirect": int(os.getenv("ADMISSION_REDIRECT_LIMIT", str(MAX_IN_FLIGHT))),
+    "auth": int(os.getenv("ADMISSION_AUTH_LIMIT", str(max(1, MAX_IN_FLIGHT // 4)))),
+    "list": int(os.getenv("ADMISSION_LIST_LIMIT", str(max(1, MAX_IN_FLIGHT // 4)))),
+    "default": int(
+        os.getenv("ADMISSION_DEFAULT_LIMIT", str(max(1, MAX_IN_FLIGHT // 2)))
+    ),
+}
+RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "10"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+
+# Paths that never touch the DB or threadpool heavily
+EXEMPT_PATHS = (
+    "/",
+    "/docs",
+    "/redoc",
+    "/openapi.json",
+    "/health/",
+    "/livez",
+    "/readyz",
+)
+
+
+# Token bucket refilled continuously at rate tokens per second
+class TokenBucket:
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, now: float):
+        self.tokens = float(RATE_LIMIT_BURST)
+        self.updated_at = now
+
+    # Take one token, return seconds to wait if the bucket is empty
+    def take(self, now: float) -> float:
+        elapsed = now - self.updated_at
+        self.tokens = min(
+            RATE_LIMIT_BURST, self.tokens + elapsed * RATE_LIMIT_PER_SECOND
+        )
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / RATE_LIMIT_PER_SECOND
+
+
+# In-flight counters per route group and buckets per client.
+# Only touched from the event loop, so no locking is needed.
+in_flight = {group: 0 for group in ROUTE_LIMITS}
+buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+
+# Map a request to its concurrency group
+def route_group(request: Request) -> str:
+    path = request.url.path
+    if path.startswith("/usr/"):
+        return "auth"
+    if path.startswith("/url/list"):
+        return "list"
+    if path.startswith("/url/") and request.method == "GET":
+        return "redirect"
+    return "default"
+
+
+# Identify the client by token username, falling back to the remote address
+# The decoded username is kept on request.state for get_current_user
+def client_key(request: Request) -> str:
+    header = request.headers.get("authorization", "")
+    if header.lower().startswith("bearer "):
+        token = header[7:]
+        username = auth.get_username_from_token(token)
+        request.state.token_username = (token, username)
+        if username:
+            return f"user:{username}"
+    host = request.client.host if request.client else "unknown"
+    return f"ip:{host}"
+
+
+# Username for the token, reusing the middleware's decode when the token matches
+def username_from_request(request: Request, token: str):
+    cached = getattr(request.state, "token_username", None)
+    if cached and cached[0] == token:
+        return cached[1]
+    return auth.get_username_from_token(token)
+
+
+# Return seconds to wait if the client is over its rate limit
+def rate_limit_wait(key: str) -> float:
+    now = time.monotonic()
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = buckets[key] = TokenBucket(now)
+        if len(buckets) > RATE_LIMIT_MAX_CLIENTS:
+            buckets.popitem(last=False)
+    else:
+        buckets.move_to_end(key)
+    return bucket.take(now)
+
+
+# 503/429 response with Retry-After header
+def reject(status_code: int, detail: str, retry_after: float = RETRY_AFTER_SECONDS):
+    return ORJSONResponse(
+        {"detail": detail},
+        status_code=status_code,
+        headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+    )
+
+
+# Middleware that sheds load before work reaches the threadpool
+async def admission_control(request: Request, call_next):
+    if request.url.path in EXEMPT_PATHS:
+        return await call_next(request)
+
+    wait = rate_limit_wait(client_key(request))
+    if wait:
+        return reject(429, "Too many requests", wait)
+
+    group = route_group(request)
+    if (
+        in_flight[group] >= ROUTE_LIMITS[group]
+        or sum(in_flight.values()) >= MAX_IN_FLIGHT
+    ):
+        return reject(503, "Server busy, try again later")
+
+    in_flight[group] += 1
+    try:
+        return await call_next(request)
+    finally:
+        in_flight[group] -= 1
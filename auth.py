@@ -7,6 +7,8 @@ from sqlmodel import Session, select
 
 from typing import Dict
 
+from tracing import traced
+
 from dotenv import load_dotenv
 import os
 
@@ -22,6 +24,7 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 # Takes access token and return user
+@traced("auth.get_username_from_token")
 def get_username_from_token(token: str):
     try:
         payload = jwt.decode(token, ACCESS_TOKEN_SECRET_KEY, algorithms=[ALGORITHM])
@@ -31,11 +34,13 @@ def get_username_from_token(token: str):
 
 
 # Return hased password
+@traced("bcrypt.hash")
 def get_password_hash(password):
     return pwd_context.hash(password)
 
 
 # Return bool after verifing the str password with hased password
+@traced("bcrypt.verify")
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -0,0 +1,62 @@
+# Fill url_hash for URLs created before the column existed, on the primary
+# and every shard. Safe to rerun: python backfill_hashes.py
+from sqlmodel import Session, select
+from sqlalchemy import Integer, String, column, update, values
+
+from models import URL
+from utils import url_hash
+
+import database
+import sharding
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+# Hash one batch of rows missing url_hash, return the number updated
+def backfill_batch(session: Session) -> int:
+    rows = session.exec(
+        select(URL.id, URL.original_url)
+        .where(URL.url_hash.is_(None))
+        .limit(BACKFILL_BATCH_SIZE)
+    ).all()
+    if not rows:
+        return 0
+
+    batch = (
+        values(column("id", Integer), column("url_hash", String), name="batch")
+        .data([(id, url_hash(original_url)) for id, original_url in rows])
+        .cte("batch")
+    )
+    session.execute(
+        update(URL).where(URL.id == batch.c.id).values(url_hash=batch.c.url_hash)
+    )
+    session.commit()
+    return len(rows)
+
+
+# Backfill every row on one database, return the number updated
+def backfill(engine) -> int:
+    total = 0
+    with Session(engine) as session:
+        while True:
+            updated = backfill_batch(session)
+            total += updated
+            if updated < BACKFILL_BATCH_SIZE:
+                return total
+
+
+def main():
+    database.init_db()
+    sharding.init_shards()
+
+    engines = {"primary": database.engine}
+    for name, engine in sharding.router.engines.items():
+        if engine is not database.engine:
+            engines[f"shard:{name}"] = engine
+
+    for name, engine in engines.items():
+        print(f"{name}: {backfill(engine)} urls hashed")
+
+
+if __name__ == "__main__":
+    main()
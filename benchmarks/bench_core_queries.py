@@ -0,0 +1,79 @@
+# Micro-benchmark for the Core read path in queries.py against the ORM
+# Run from the project root: python -m benchmarks.bench_core_queries
+import timeit
+import tracemalloc
+
+from sqlmodel import SQLModel, Session, create_engine, select
+
+import queries
+from models import URL, User
+
+ROWS = 1_000
+NUMBER = 200
+REPEAT = 5
+
+engine = create_engine("sqlite://")
+SQLModel.metadata.create_all(engine)
+
+with Session(engine) as session:
+    session.add(User(id=1, username="benchuser", hashed_password="x"))
+    session.add_all(
+        URL(original_url=f"https://example.com/{i}", short_code=f"code{i}", user_id=1)
+        for i in range(ROWS)
+    )
+    session.commit()
+
+session = Session(engine)
+
+
+def orm_user():
+    session.exec(select(User).where(User.username == "benchuser")).first()
+    session.expunge_all()
+
+
+def core_user():
+    queries.get_user(session, "benchuser")
+
+
+def orm_url():
+    session.exec(
+        select(URL).where(URL.user_id == 1).where(URL.short_code == "code500")
+    ).first()
+    session.expunge_all()
+
+
+def core_url():
+    queries.get_url(session, 1, "code500")
+
+
+def orm_list():
+    session.exec(select(URL).where(URL.user_id == 1)).all()
+    session.expunge_all()
+
+
+def core_list():
+    queries.list_urls(session, 1)
+
+
+# Peak bytes allocated by one call
+def peak_allocation(func):
+    func()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == "__main__":
+    for name, orm_func, core_func, number in (
+        ("user lookup", orm_user, core_user, NUMBER),
+        ("url lookup", orm_url, core_url, NUMBER),
+        (f"list {ROWS} urls", orm_list, core_list, NUMBER // 20),
+    ):
+        for path, func in (("ORM", orm_func), ("Core", core_func)):
+            best = min(timeit.repeat(func, number=number, repeat=REPEAT)) / number
+            peak = peak_allocation(func) / 1024
+            print(
+                f"{name:<16} {path:<5} {best * 1e6:10.1f} us/call {peak:10.1f} KiB peak"
+            )
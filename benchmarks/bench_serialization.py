@@ -0,0 +1,48 @@
+# Micro-benchmark for /url/list/ serialization
+# Run from the project root: python -m benchmarks.bench_serialization
+import datetime
+import timeit
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from models import URL
+
+ROWS = 10_000
+REPEAT = 5
+
+FIELDS = ("id", "original_url", "short_code", "created_at", "user_id")
+now = datetime.datetime.utcnow()
+
+# Same data as ORM objects and as plain row tuples
+orm_rows = [
+    URL(
+        id=i,
+        original_url=f"https://example.com/{i}",
+        short_code=f"code{i}",
+        created_at=now,
+        user_id=1,
+    )
+    for i in range(ROWS)
+]
+tuple_rows = [(i, f"https://example.com/{i}", f"code{i}", now, 1) for i in range(ROWS)]
+
+
+# Old path: jsonable_encoder over ORM objects, then stdlib json
+def orm_jsonable_encoder():
+    return JSONResponse(jsonable_encoder(orm_rows)).body
+
+
+# New path: tuples zipped into dicts, encoded by orjson
+def tuples_orjson():
+    return orjson.dumps([dict(zip(FIELDS, row)) for row in tuple_rows])
+
+
+if __name__ == "__main__":
+    for name, func in (
+        ("ORM + jsonable_encoder", orm_jsonable_encoder),
+        ("tuples + orjson", tuples_orjson),
+    ):
+        best = min(timeit.repeat(func, number=1, repeat=REPEAT))
+        print(f"{name:<24} {ROWS} rows: {best * 1000:8.2f} ms")
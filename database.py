@@ -1,4 +1,6 @@
 from sqlmodel import SQLModel, create_engine, Session, inspect
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
 
 from dotenv import load_dotenv
 import os
@@ -12,11 +14,48 @@ username = os.getenv("USR")
 password = os.getenv("PWD")
 port_id = os.getenv("PORT")
 
+# Pool settings, checkout fails fast instead of queueing behind a slow DB
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "2"))
+
 DATABASE_URL = (
     f"postgresql+psycopg2://{username}:{password}@{hostname}:{port_id}/{database}"
 )
 
-engine = create_engine(DATABASE_URL, echo=True)
+engine = create_engine(
+    DATABASE_URL,
+    echo=True,
+    pool_size=POOL_SIZE,
+    max_overflow=POOL_MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT,
+)
+
+
+# url columns added after release, with the statements that add them
+URL_UPGRADES = {
+    "url_hash": [
+        "ALTER TABLE url ADD COLUMN url_hash VARCHAR(32)",
+        "CREATE INDEX IF NOT EXISTS ix_url_user_id_url_hash ON url (user_id, url_hash)",
+    ],
+    "expires_at": [
+        "ALTER TABLE url ADD COLUMN expires_at TIMESTAMP",
+        "CREATE INDEX IF NOT EXISTS ix_url_expires_at ON url (expires_at) "
+        "WHERE expires_at IS NOT NULL",
+    ],
+}
+
+
+# Engine for another database (shard or replica) with the same pool limits
+def create_db_engine(url: str):
+    if url.startswith("sqlite"):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    return create_engine(
+        url,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+    )
 
 
 # Create session and close automaticall with DB
@@ -34,3 +73,24 @@ def init_db():
         or not inspector.has_table("refreshtoken")
     ):
         SQLModel.metadata.create_all(engine)
+
+    upgrade_url_table(engine)
+
+
+# Add columns introduced after the url table was first created
+# Workers booting together may race on the same upgrade. The column and its
+# index are added in one transaction, so a worker that loses the race only
+# needs to see that the column now exists.
+def upgrade_url_table(engine):
+    columns = {column["name"] for column in inspect(engine).get_columns("url")}
+    for column, statements in URL_UPGRADES.items():
+        if column in columns:
+            continue
+        try:
+            with engine.begin() as conn:
+                for statement in statements:
+                    conn.execute(text(statement))
+        except DBAPIError:
+            columns = {item["name"] for item in inspect(engine).get_columns("url")}
+            if column not in columns:
+                raise
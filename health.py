@@ -0,0 +1,88 @@
+from sqlalchemy import text
+
+from dotenv import load_dotenv
+import threading
+import time
+import os
+
+import database
+import sharding
+
+load_dotenv()
+
+# Readiness settings. A background thread checks every database each
+# HEALTH_CHECK_INTERVAL seconds. Probes only read the cached result.
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "2"))
+HEALTH_MAX_LATENCY_MS = float(os.getenv("HEALTH_MAX_LATENCY_MS", "500"))
+HEALTH_MAX_POOL_USAGE = float(os.getenv("HEALTH_MAX_POOL_USAGE", "0.9"))
+
+# Last check result, not ready until the first check has run
+status = {"ready": False, "checked_at": None, "databases": {}}
+
+
+# Share of the engine's pool connections in use. Capacity is read from each
+# engine's own pool, since shards and replicas may be sized differently.
+# Pools without a size limit (e.g. SQLite memory pools) report 0.
+def pool_usage(engine) -> float:
+    pool = engine.pool
+    checkedout = getattr(pool, "checkedout", None)
+    size = getattr(pool, "size", None)
+    max_overflow = getattr(pool, "_max_overflow", None)
+    if checkedout is None or size is None or max_overflow is None or max_overflow < 0:
+        return 0.0
+    capacity = size() + max_overflow
+    return checkedout() / capacity if capacity else 0.0
+
+
+# Check one database, return its status
+def check_database(engine) -> dict:
+    usage = pool_usage(engine)
+    start = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception:
+        return {"ok": False, "latency_ms": None, "pool_usage": usage}
+
+    latency = (time.perf_counter() - start) * 1000
+    return {
+        "ok": latency <= HEALTH_MAX_LATENCY_MS and usage <= HEALTH_MAX_POOL_USAGE,
+        "latency_ms": round(latency, 2),
+        "pool_usage": round(usage, 2),
+    }
+
+
+# Refresh the cached status for the primary and every URL shard
+def check_health():
+    global status
+    engines = {"primary": database.engine}
+    for name, engine in sharding.router.engines.items():
+        if engine is not database.engine:
+            engines[f"shard:{name}"] = engine
+
+    databases = {name: check_database(engine) for name, engine in engines.items()}
+    status = {
+        "ready": all(result["ok"] for result in databases.values()),
+        "checked_at": time.time(),
+        "databases": databases,
+    }
+
+
+# Return the cached status, not ready when the checker has stalled
+def readiness() -> dict:
+    current = status
+    checked_at = current["checked_at"]
+    if checked_at is None or time.time() - checked_at > 3 * HEALTH_CHECK_INTERVAL:
+        return {**current, "ready": False}
+    return current
+
+
+def check_loop():
+    while True:
+        check_health()
+        time.sleep(HEALTH_CHECK_INTERVAL)
+
+
+# Start the background health checker
+def start_checker():
+    threading.Thread(target=check_loop, name="health-check", daemon=True).start()
@@ -1,14 +1,15 @@
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, BackgroundTasks
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2PasswordBearer
 
 from sqlmodel import Session, select
+from sqlalchemy import String, column, delete, update, values
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from models import URL, User
 from database import get_session, init_db
 
-from utils import normalize_url
+from utils import normalize_url, url_hash, utcnow, to_utc
 
 from schemas import (
     UserCreate,
@@ -20,9 +21,30 @@ from schemas import (
     UserResponse,
     DeleteUserRequest,
     RefreshRequest,
+    URLResponse,
+    UpdateResponse,
+    BatchDeleteRequest,
+    BatchUpdateRequest,
+    BatchResult,
+    BatchResponse,
 )
 
+from dotenv import load_dotenv
+import os
+
 import auth
+import admission
+import accounts
+import queries
+import sharding
+import replicas
+import reaper
+import profiling
+import tracing
+import health
+from tracing import TracedORJSONResponse
+
+load_dotenv()
 
 # FastAPI Tags
 tags_metadata = [
@@ -35,19 +57,57 @@ tags_metadata = [
 ]
 
 # FastAPI instance
-app = FastAPI(openapi_tags=tags_metadata)
+app = FastAPI(openapi_tags=tags_metadata, default_response_class=TracedORJSONResponse)
 app.title = "URL Shorty"
 
+# Shed load before it queues in the threadpool or on the DB pool
+app.middleware("http")(admission.admission_control)
+
+# Opt-in sampling profiler, not installed unless PROFILE_ENABLED is set
+if profiling.PROFILE_ENABLED:
+    app.middleware("http")(profiling.profile_requests)
+
+# Request tracing with spans for auth, SQL, bcrypt and response encoding
+if tracing.TRACE_ENABLED:
+    app.middleware("http")(tracing.trace_requests)
+    tracing.start_exporter()
+
+
+# DB pool checkout waited past DB_POOL_TIMEOUT
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    return admission.reject(503, "Database busy, try again later")
+
+
 # For serving templates
 templates = Jinja2Templates(directory="templates")
 
-# Check if model/table exists in DB
+# Check if model/table exists in DB and on every URL shard
 init_db()
+sharding.init_shards()
+replicas.start_checker()
+reaper.start_reaper()
+health.start_checker()
+
+# Max short codes accepted by the batch endpoints
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
 
 # Dependency for user auth
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/usr/login")
 
 
+# Build the response model for a URL row
+def to_url_response(url) -> URLResponse:
+    return URLResponse(
+        id=url.id,
+        original_url=url.original_url,
+        short_code=url.short_code,
+        created_at=url.created_at,
+        user_id=url.user_id,
+        expires_at=url.expires_at,
+    )
+
+
 # Index Page
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -57,7 +117,9 @@ async def read_root(request: Request):
 # *** User authentication and authorization ***
 # Register User
 @app.post("/usr/register", tags=["Authentication"])
-def register(user: UserCreate, session: Session = Depends(get_session)):
+def register(
+    user: UserCreate, response: Response, session: Session = Depends(get_session)
+):
     # Username and password len and characters check
     if not user.username.isalpha():
         raise HTTPException(status_code=400, detail="Username must be only alphabets")
@@ -70,7 +132,12 @@ def register(user: UserCreate, session: Session = Depends(get_session)):
             status_code=400, detail="Password must be minimum 8 characters"
         )
 
-    existing = session.exec(select(User).where(User.username == user.username)).first()
+    # A name stays taken until its account's background delete finishes
+    existing = session.exec(
+        select(User).where(
+            User.username.in_([user.username, accounts.pending_username(user.username)])
+        )
+    ).first()
     if existing:
         raise HTTPException(status_code=400, detail="Username already registered")
 
@@ -79,6 +146,7 @@ def register(user: UserCreate, session: Session = Depends(get_session)):
     session.add(db_user)
     session.commit()
     session.refresh(db_user)
+    replicas.mark_write(db_user.username, response)
     return {"id": db_user.id, "username": db_user.username}
 
 
@@ -104,20 +172,56 @@ def login(data: LoginRequest, session: Session = Depends(get_session)):
 # Takes access token and return user for it
 @app.get("/usr/me", tags=["Authentication"])
 def get_current_user(
+    request: Request,
     token: str = Depends(oauth2_scheme),
     session: Session = Depends(get_session),
 ) -> UserResponse:
-    username = auth.get_username_from_token(token)
+    username = admission.username_from_request(request, token)
     if not username:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    user = session.exec(select(User).where(User.username == username)).first()
+    with tracing.span("get_current_user.lookup"), replicas.read_session(
+        session, username, request
+    ) as read_session:
+        user = queries.get_user(read_session, username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     return UserResponse(username=user.username, id=user.id)
 
 
+# Session on the shard holding the current user's URLs
+def get_url_session(
+    response: Response,
+    user: UserResponse = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    replicas.mark_write(user.username, response)
+
+    # Single database, reuse the request's session
+    if sharding.router.is_single:
+        yield session
+        return
+
+    with sharding.router.session_for(user.id) as url_session:
+        yield url_session
+
+
+# Read-only session for the current user's URLs, on a replica when possible
+def get_url_read_session(
+    request: Request,
+    user: UserResponse = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    if not sharding.router.is_single:
+        with sharding.router.session_for(user.id) as url_session:
+            yield url_session
+        return
+
+    with replicas.read_session(session, user.username, request) as read_session:
+        yield read_session
+
+
 # Takes refresh token and return new access token
 @app.post("/usr/refresh", tags=["Authentication"])
 def refresh_token_endpoint(data: RefreshRequest):
@@ -137,59 +241,102 @@ def logout(data: LogoutRequest, session: Session = Depends(get_session)):
 
 # Delete user and related urls
 @app.delete("/usr/delete", tags=["Authentication"])
-def delete_user(data: DeleteUserRequest, session: Session = Depends(get_session)):
+def delete_user(
+    data: DeleteUserRequest,
+    background_tasks: BackgroundTasks,
+    session: Session = Depends(get_session),
+):
+    scheduled = {
+        "message": f"User '{data.username}' and related data scheduled for deletion."
+    }
     user = session.exec(select(User).where(User.username == data.username)).first()
 
+    # Repeated request for an account already being deleted in the background
     if not user:
+        pending = session.exec(
+            select(User).where(
+                User.username == accounts.pending_username(data.username)
+            )
+        ).first()
+        if pending and auth.verify_password(data.password, pending.hashed_password):
+            return scheduled
         raise HTTPException(status_code=401, detail="User doesn't exist.")
 
     if not auth.verify_password(data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    session.delete(user)
-    session.commit()
+    # Large accounts are blocked, then removed in chunks after the response
+    with sharding.router.session_for(user.id) as url_session:
+        is_large = accounts.is_large_account(user.id, url_session)
+    if is_large:
+        replicas.mark_write(data.username)
+        if accounts.block_user(user, session):
+            background_tasks.add_task(accounts.delete_user_in_chunks, user.id)
+        return scheduled
+
+    accounts.delete_user_data(user.id, session)
     return {"message": f"User '{data.username}' and related data deleted successfully."}
 
 
-# Server and DB check
+# Server and DB check, from the cached readiness result
 @app.get("/health/", tags=["Features"])
-def server_check(
-    session: Session = Depends(get_session),
-):
-    try:
-        session.exec(select(1))
-        return {
-            "status": "Server running and Database connection successful",
-        }
-    except:
+def server_check():
+    if not health.readiness()["ready"]:
         raise HTTPException(status_code=500, detail=f"Database error.")
+    return {
+        "status": "Server running and Database connection successful",
+    }
+
+
+# Liveness probe, no I/O
+@app.get("/livez", tags=["Features"])
+async def liveness():
+    return {"status": "alive"}
+
+
+# Readiness probe, served from the background health check
+@app.get("/readyz", tags=["Features"])
+async def readiness():
+    status = health.readiness()
+    return TracedORJSONResponse(status, status_code=200 if status["ready"] else 503)
 
 
 # *** UrlShorty Features ***
 # List all urls
-@app.get("/url/list/", tags=["Features"])
+@app.get("/url/list/", tags=["Features"], response_model=list[URLResponse])
 def List_url(
     user: UserResponse = Depends(get_current_user),
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_url_read_session),
 ):
-    rows = session.exec(select(URL).where(URL.user_id == user.id)).all()
-    rows_json = jsonable_encoder(rows)
-    return rows_json
+    # Select plain columns and encode the tuples directly, skipping ORM objects
+    rows = queries.list_urls(session, user.id)
+    return TracedORJSONResponse([dict(zip(queries.URL_FIELDS, row)) for row in rows])
 
 
 # Create a short url
 @app.post("/url/shorten/", tags=["Features"])
 def shorten_url(
     request: CreateRequest,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_url_session),
     user: UserResponse = Depends(get_current_user),
-):
+) -> URLResponse:
     original_url = normalize_url(request.original_url)
+    original_hash = url_hash(original_url)
     short_code = request.short_code
 
     if not short_code.isalpha():
         raise HTTPException(status_code=403, detail="Only use alphabtes for short code")
 
+    expires_at = to_utc(request.expires_at) if request.expires_at else None
+    if expires_at and expires_at <= utcnow():
+        raise HTTPException(status_code=400, detail="Expiry must be in the future")
+
+    # Return the user's existing code for the same destination
+    if request.reuse_existing:
+        for row in queries.find_by_hash(session, user.id, original_hash):
+            if not row.expires_at or row.expires_at > utcnow():
+                return to_url_response(queries.URLRecord(*row))
+
     statement = (
         select(URL).where(URL.user_id == user.id).where(URL.short_code == short_code)
     )
@@ -199,29 +346,46 @@ def shorten_url(
             status_code=403, detail="Short code is already used by this user."
         )
 
-    url = URL(original_url=original_url, short_code=short_code, user_id=user.id)
+    url = URL(
+        original_url=original_url,
+        url_hash=original_hash,
+        short_code=short_code,
+        expires_at=expires_at,
+        user_id=user.id,
+    )
     session.add(url)
     session.commit()
     session.refresh(url)
 
-    return url.__dict__
+    return to_url_response(url)
     # return {"short_url": f"https://urlshorty.gurdeepkumar.com/url/{url.short_code}"}
 
 
+# List the user's short codes pointing at a destination URL
+@app.get("/url/lookup/", tags=["Features"], response_model=list[URLResponse])
+def lookup_url(
+    url: str,
+    user: UserResponse = Depends(get_current_user),
+    session: Session = Depends(get_url_read_session),
+):
+    rows = queries.find_by_hash(session, user.id, url_hash(url))
+    return TracedORJSONResponse([dict(zip(queries.URL_FIELDS, row)) for row in rows])
+
+
 # Get the orignal URL
 @app.get("/url/{short_code}", tags=["Features"])
 def redirect_to_url(
     short_code: str,
     user: UserResponse = Depends(get_current_user),
-    session: Session = Depends(get_session),
-):
-    url = session.exec(
-        select(URL).where(URL.user_id == user.id).where(URL.short_code == short_code)
-    ).first()
+    session: Session = Depends(get_url_read_session),
+) -> URLResponse:
+    url = queries.get_url(session, user.id, short_code)
     if not url:
         raise HTTPException(status_code=404, detail="Short URL not found")
+    if url.expires_at and url.expires_at <= utcnow():
+        raise HTTPException(status_code=410, detail="Short URL has expired")
 
-    return url.__dict__
+    return to_url_response(url)
     # return RedirectResponse(url.original_url, status_code=307)
 
 
@@ -230,7 +394,7 @@ def redirect_to_url(
 def delete_url(
     request: DeleteRequest,
     user: UserResponse = Depends(get_current_user),
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_url_session),
 ):
     short_code = request.short_code
     statement = (
@@ -251,8 +415,8 @@ def delete_url(
 def update_url(
     request: UpdateRequest,
     user: UserResponse = Depends(get_current_user),
-    session: Session = Depends(get_session),
-):
+    session: Session = Depends(get_url_session),
+) -> UpdateResponse:
     short_code = request.short_code
     updated_url = normalize_url(request.updated_url)
     statement = (
@@ -264,8 +428,94 @@ def update_url(
         raise HTTPException(status_code=404, detail="URL not found")
 
     url.original_url = updated_url
+    url.url_hash = url_hash(updated_url)
     session.add(url)
     session.commit()
     session.refresh(url)
 
-    return {"message": "URL updated successfully", "data": url}
+    return UpdateResponse(message="URL updated successfully", data=to_url_response(url))
+
+
+# Build per-code results in request order
+def batch_results(short_codes, changed, status: str) -> BatchResponse:
+    return BatchResponse(
+        results=[
+            BatchResult(
+                short_code=code, status=status if code in changed else "not_found"
+            )
+            for code in short_codes
+        ]
+    )
+
+
+# Delete many URLs with one statement
+@app.delete("/url/batch", tags=["Features"])
+def delete_url_batch(
+    request: BatchDeleteRequest,
+    user: UserResponse = Depends(get_current_user),
+    session: Session = Depends(get_url_session),
+) -> BatchResponse:
+    short_codes = list(dict.fromkeys(request.short_codes))
+    if len(short_codes) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413, detail=f"Maximum {MAX_BATCH_SIZE} short codes per batch"
+        )
+
+    statement = (
+        delete(URL)
+        .where(URL.user_id == user.id)
+        .where(URL.short_code.in_(short_codes))
+        .returning(URL.short_code)
+    )
+    deleted = set(session.execute(statement).scalars())
+    session.commit()
+
+    return batch_results(short_codes, deleted, "deleted")
+
+
+# Update many URLs with one statement
+@app.patch("/url/batch", tags=["Features"])
+def update_url_batch(
+    request: BatchUpdateRequest,
+    user: UserResponse = Depends(get_current_user),
+    session: Session = Depends(get_url_session),
+) -> BatchResponse:
+    updates = {
+        item.short_code: normalize_url(item.updated_url) for item in request.urls
+    }
+    if len(updates) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413, detail=f"Maximum {MAX_BATCH_SIZE} short codes per batch"
+        )
+
+    if not updates:
+        return BatchResponse(results=[])
+
+    # Join against a VALUES list so the UPDATE matches each row by short code.
+    # A CTE carries the column names, which SQLite can't alias on a subquery.
+    batch = (
+        values(
+            column("short_code", String),
+            column("original_url", String),
+            column("url_hash", String),
+            name="batch",
+        )
+        .data(
+            [
+                (code, updated_url, url_hash(updated_url))
+                for code, updated_url in updates.items()
+            ]
+        )
+        .cte("batch")
+    )
+    statement = (
+        update(URL)
+        .where(URL.user_id == user.id)
+        .where(URL.short_code == batch.c.short_code)
+        .values(original_url=batch.c.original_url, url_hash=batch.c.url_hash)
+        .returning(URL.short_code)
+    )
+    updated = set(session.execute(statement).scalars())
+    session.commit()
+
+    return batch_results(updates, updated, "updated")
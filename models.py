@@ -1,26 +1,55 @@
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index, text
 from typing import Optional, List
 import datetime
 
 
 # URL model
 class URL(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_url_user_id_url_hash", "user_id", "url_hash"),
+        # Partial index, only links with an expiry are indexed for the reaper
+        Index(
+            "ix_url_expires_at",
+            "expires_at",
+            postgresql_where=text("expires_at IS NOT NULL"),
+            sqlite_where=text("expires_at IS NOT NULL"),
+        ),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     original_url: str
+    url_hash: Optional[str] = Field(default=None, max_length=32)
     short_code: str = Field(index=True)
     created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    expires_at: Optional[datetime.datetime] = None
 
-    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    user_id: Optional[int] = Field(
+        default=None, foreign_key="user.id", index=True, ondelete="CASCADE"
+    )
     user: Optional["User"] = Relationship(back_populates="urls")
 
 
+# Expired URLs moved out of the url table by the reaper
+class ArchivedURL(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    original_url: str
+    url_hash: Optional[str] = Field(default=None, max_length=32)
+    short_code: str
+    created_at: datetime.datetime
+    expires_at: Optional[datetime.datetime] = None
+    user_id: Optional[int] = None
+
+
 # Refresh token model
 class RefreshToken(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     token: str
     created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
 
-    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    user_id: Optional[int] = Field(
+        default=None, foreign_key="user.id", ondelete="CASCADE"
+    )
     user: Optional["User"] = Relationship(back_populates="refresh_tokens")
 
 
@@ -31,9 +60,14 @@ class User(SQLModel, table=True):
     hashed_password: str
 
     urls: List[URL] = Relationship(
-        back_populates="user", sa_relationship_kwargs={"cascade": "all, delete"}
+        back_populates="user",
+        sa_relationship_kwargs={"cascade": "all, delete", "passive_deletes": True},
     )
 
     refresh_tokens: List["RefreshToken"] = Relationship(
-        back_populates="user", sa_relationship_kwargs={"cascade": "all, delete-orphan"}
+        back_populates="user",
+        sa_relationship_kwargs={
+            "cascade": "all, delete-orphan",
+            "passive_deletes": True,
+        },
     )
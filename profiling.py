@@ -0,0 +1,128 @@
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+
+from collections import Counter
+from dotenv import load_dotenv
+import threading
+import secrets
+import random
+import time
+import sys
+import os
+
+load_dotenv()
+
+# Profiler settings. The middleware is only installed when PROFILE_ENABLED is
+# set. It then samples PROFILE_SAMPLE_RATE of requests, plus any request whose
+# PROFILE_HEADER matches PROFILE_TOKEN.
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "20"))
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Long running background threads left out of request profiles
+IGNORED_THREADS = {
+    "profile-sampler",
+    "replica-check",
+    "url-reaper",
+    "trace-export",
+    "health-check",
+}
+
+
+# Return bool if the frame's code belongs to this app, not a library
+def is_app_code(filename: str) -> bool:
+    return filename.startswith(APP_DIR) and "site-packages" not in filename
+
+
+# Collapse a thread stack into "root;...;leaf". Returns None for threads not
+# running app code, such as idle threadpool workers.
+def collapse(frame):
+    names = []
+    in_app = False
+    while frame is not None:
+        code = frame.f_code
+        in_app = in_app or is_app_code(code.co_filename)
+        filename = os.path.basename(code.co_filename)
+        names.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    if not in_app:
+        return None
+    return ";".join(reversed(names))
+
+
+# Samples every thread's stack until stopped. Sync endpoints run in the
+# threadpool, so threads are not filtered by request: concurrent requests
+# running app code on the same worker show up in the profile too.
+class Sampler(threading.Thread):
+    def __init__(self):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        ignored = {
+            thread.ident
+            for thread in threading.enumerate()
+            if thread.name in IGNORED_THREADS
+        }
+        while not self.stopped.wait(PROFILE_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident in ignored:
+                    continue
+                stack = collapse(frame)
+                if stack:
+                    self.stacks[stack] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+# Return bool if this request should be profiled
+def should_profile(request: Request) -> bool:
+    value = request.headers.get(PROFILE_HEADER)
+    if value and PROFILE_TOKEN and secrets.compare_digest(value, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+# Write collapsed stacks for a route and keep its newest PROFILE_MAX_FILES.
+# The output works with flamegraph.pl and speedscope.
+def write_profile(route: str, stacks: Counter):
+    slug = route.strip("/").replace("/", "_").replace("{", "").replace("}", "")
+    route_dir = os.path.join(PROFILE_DIR, slug or "index")
+    os.makedirs(route_dir, exist_ok=True)
+
+    path = os.path.join(route_dir, f"{time.time_ns()}.folded")
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+    files = sorted(os.listdir(route_dir))
+    for name in files[:-PROFILE_MAX_FILES]:
+        os.remove(os.path.join(route_dir, name))
+
+
+# Middleware that profiles sampled requests
+async def profile_requests(request: Request, call_next):
+    if not should_profile(request):
+        return await call_next(request)
+
+    sampler = Sampler()
+    sampler.start()
+    try:
+        response = await call_next(request)
+    finally:
+        sampler.stop()
+
+    route = request.scope.get("route")
+    path = route.path if route else "unmatched"
+    if sampler.stacks:
+        await run_in_threadpool(write_profile, path, sampler.stacks)
+    return response
@@ -0,0 +1,94 @@
+from sqlalchemy import bindparam, select
+from sqlmodel import Session
+
+from models import URL, User
+
+# Read-only fast path for hot routes. Statements are built once against the
+# Core tables so SQLAlchemy reuses their compiled form, and rows come back as
+# tuples or small __slots__ records instead of identity-mapped ORM instances.
+# Writes stay on the ORM.
+
+url_table = URL.__table__
+user_table = User.__table__
+
+URL_FIELDS = (
+    "id",
+    "original_url",
+    "short_code",
+    "created_at",
+    "user_id",
+    "expires_at",
+)
+URL_COLUMNS = tuple(url_table.c[field] for field in URL_FIELDS)
+
+
+# Lightweight user row
+class UserRecord:
+    __slots__ = ("id", "username")
+
+    def __init__(self, id: int, username: str):
+        self.id = id
+        self.username = username
+
+
+# Lightweight URL row
+class URLRecord:
+    __slots__ = URL_FIELDS
+
+    def __init__(self, id, original_url, short_code, created_at, user_id, expires_at):
+        self.id = id
+        self.original_url = original_url
+        self.short_code = short_code
+        self.created_at = created_at
+        self.user_id = user_id
+        self.expires_at = expires_at
+
+
+USER_BY_USERNAME = select(user_table.c.id, user_table.c.username).where(
+    user_table.c.username == bindparam("username")
+)
+
+URL_BY_SHORT_CODE = (
+    select(*URL_COLUMNS)
+    .where(url_table.c.user_id == bindparam("user_id"))
+    .where(url_table.c.short_code == bindparam("short_code"))
+    .limit(1)
+)
+
+URLS_BY_USER = select(*URL_COLUMNS).where(url_table.c.user_id == bindparam("user_id"))
+
+URLS_BY_HASH = (
+    select(*URL_COLUMNS)
+    .where(url_table.c.user_id == bindparam("user_id"))
+    .where(url_table.c.url_hash == bindparam("url_hash"))
+)
+
+
+# Return user record for username or None
+def get_user(session: Session, username: str):
+    row = session.connection().execute(USER_BY_USERNAME, {"username": username}).first()
+    return UserRecord(*row) if row else None
+
+
+# Return URL record for user's short code or None
+def get_url(session: Session, user_id: int, short_code: str):
+    row = (
+        session.connection()
+        .execute(URL_BY_SHORT_CODE, {"user_id": user_id, "short_code": short_code})
+        .first()
+    )
+    return URLRecord(*row) if row else None
+
+
+# Return all user's URLs as plain tuples in URL_FIELDS order
+def list_urls(session: Session, user_id: int):
+    return session.connection().execute(URLS_BY_USER, {"user_id": user_id}).all()
+
+
+# Return user's URLs pointing at the destination with url_hash
+def find_by_hash(session: Session, user_id: int, url_hash: str):
+    return (
+        session.connection()
+        .execute(URLS_BY_HASH, {"user_id": user_id, "url_hash": url_hash})
+        .all()
+    )
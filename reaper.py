@@ -0,0 +1,81 @@
+from sqlmodel import Session, select
+from sqlalchemy import delete, insert
+
+from models import URL, ArchivedURL
+from utils import utcnow
+
+from dotenv import load_dotenv
+import threading
+import logging
+import time
+import os
+
+import sharding
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Reaper settings. Expired URLs are deleted, or moved to archivedurl when
+# REAPER_ARCHIVE is set, in batches of REAPER_BATCH_SIZE.
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "60"))
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "1000"))
+REAPER_ARCHIVE = os.getenv("REAPER_ARCHIVE", "false").lower() == "true"
+
+ARCHIVE_COLUMNS = [column.key for column in ArchivedURL.__table__.columns]
+
+
+# Remove one batch of expired URLs, return the number removed. Rows are
+# picked through the partial index on expires_at and locked with SKIP LOCKED
+# so reapers in several workers don't wait on each other.
+def reap_batch(session: Session, now) -> int:
+    ids = session.exec(
+        select(URL.id)
+        .where(URL.expires_at.is_not(None))
+        .where(URL.expires_at <= now)
+        .limit(REAPER_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not ids:
+        return 0
+
+    if REAPER_ARCHIVE:
+        columns = [getattr(URL, key) for key in ARCHIVE_COLUMNS]
+        session.execute(
+            insert(ArchivedURL).from_select(
+                ARCHIVE_COLUMNS, select(*columns).where(URL.id.in_(ids))
+            )
+        )
+    session.execute(delete(URL).where(URL.id.in_(ids)))
+    session.commit()
+    return len(ids)
+
+
+# Reap every shard until no expired URLs are left, return the number removed
+def reap_expired() -> int:
+    now = utcnow()
+    total = 0
+    for engine in sharding.router.engines.values():
+        if REAPER_ARCHIVE:
+            ArchivedURL.__table__.create(engine, checkfirst=True)
+        with Session(engine) as session:
+            while True:
+                removed = reap_batch(session, now)
+                total += removed
+                if removed < REAPER_BATCH_SIZE:
+                    break
+    return total
+
+
+def reap_loop():
+    while True:
+        try:
+            reap_expired()
+        except Exception:
+            logger.exception("Reaping expired URLs failed")
+        time.sleep(REAPER_INTERVAL)
+
+
+# Start the background reaper
+def start_reaper():
+    threading.Thread(target=reap_loop, name="url-reaper", daemon=True).start()
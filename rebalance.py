@@ -0,0 +1,117 @@
+# Move URL rows to the shard that owns their user under the current SHARD_URLS.
+# Run after adding or removing a shard, passing databases that are no longer
+# in SHARD_URLS with --from so their rows are moved too:
+#   python rebalance.py [--dry-run] [--from old=url,...] [--from-primary]
+import argparse
+
+from sqlmodel import Session, inspect, select
+from sqlalchemy import delete, insert
+
+from models import URL
+
+import database
+import sharding
+
+COPY_CHUNK_SIZE = 1000
+
+# Columns copied between shards, ids are assigned by the target shard
+COPY_COLUMNS = [column for column in URL.__table__.columns if column.key != "id"]
+
+
+# Current shards plus the extra source databases, as {name: engine}
+def source_engines(router: sharding.ShardRouter, sources: dict = None) -> dict:
+    engines = dict(router.engines)
+    for name, engine in (sources or {}).items():
+        if engine in engines.values():
+            continue
+        if name in engines:
+            raise ValueError(f"Source '{name}' has the name of a current shard")
+        engines[name] = engine
+    return engines
+
+
+# Return [(user_id, source, target)] for users stored on the wrong shard.
+# Every user on a source that is not a current shard is moved.
+def plan_moves(router: sharding.ShardRouter, sources: dict = None):
+    moves = []
+    for source, engine in source_engines(router, sources).items():
+        if not inspect(engine).has_table(URL.__table__.name):
+            continue
+        with Session(engine) as session:
+            user_ids = session.exec(
+                select(URL.user_id).where(URL.user_id.is_not(None)).distinct()
+            ).all()
+        for user_id in user_ids:
+            target = router.shard_for(user_id)
+            if target != source:
+                moves.append((user_id, source, target))
+    return moves
+
+
+# Copy user's URLs from source to target, then delete them from source.
+# Codes the user already has on the target win, so links created on the
+# target after the shard change are kept and a rerun after a crash is safe.
+def move_user(engines: dict, user_id: int, source: str, target: str):
+    with Session(engines[source]) as src, Session(engines[target]) as dst:
+        existing = set(
+            dst.exec(select(URL.short_code).where(URL.user_id == user_id)).all()
+        )
+        rows = src.execute(select(*COPY_COLUMNS).where(URL.user_id == user_id))
+
+        copied = 0
+        while chunk := rows.fetchmany(COPY_CHUNK_SIZE):
+            values = [row._asdict() for row in chunk if row.short_code not in existing]
+            if values:
+                dst.execute(insert(URL.__table__), values)
+                dst.commit()
+                copied += len(values)
+
+        src.execute(delete(URL).where(URL.user_id == user_id))
+        src.commit()
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebalance URL rows across shards")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only print the planned moves"
+    )
+    parser.add_argument(
+        "--from",
+        dest="sources",
+        default="",
+        help="Old shards no longer in SHARD_URLS, as name=url pairs like SHARD_URLS",
+    )
+    parser.add_argument(
+        "--from-primary",
+        action="store_true",
+        help="Also move URLs stored on the primary, when turning sharding on",
+    )
+    args = parser.parse_args()
+
+    router = sharding.router
+    sharding.init_shards()
+
+    sources = {
+        name: database.create_db_engine(url)
+        for name, url in sharding.parse_shard_urls(args.sources).items()
+    }
+    if args.from_primary:
+        sources["primary"] = database.engine
+    for engine in sources.values():
+        if inspect(engine).has_table(URL.__table__.name):
+            database.upgrade_url_table(engine)
+
+    engines = source_engines(router, sources)
+    moves = plan_moves(router, sources)
+    print(f"{len(moves)} users to move")
+    for user_id, source, target in moves:
+        if args.dry_run:
+            print(f"user {user_id}: {source} -> {target}")
+            continue
+        copied = move_user(engines, user_id, source, target)
+        print(f"user {user_id}: {source} -> {target}, {copied} urls copied")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+from fastapi import Request, Response
+from sqlmodel import Session
+from sqlalchemy import text
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import threading
+import hashlib
+import random
+import math
+import hmac
+import time
+import os
+
+import database
+import auth
+
+load_dotenv()
+
+# Replica settings. REPLICA_URLS is a comma separated list of read replicas
+# of the primary database. Without it every read goes to the primary.
+REPLICA_URLS = [url for url in os.getenv("REPLICA_URLS", "").split(",") if url]
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "5"))
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "2"))
+STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+STICKY_MAX_USERS = 10000
+STICKY_COOKIE = "last_write"
+
+# Replica lag in seconds. When all received WAL is replayed the replica is
+# caught up and lag is 0, even if the primary has been idle since its last
+# transaction. Otherwise it is the age of the last replayed transaction.
+LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "END"
+)
+
+engines = [database.create_db_engine(url) for url in REPLICA_URLS]
+
+# Replicas that passed the last health check
+healthy = []
+
+# username -> time of the user's last write, oldest first. Writes come from
+# threadpool threads, so updates hold write_lock. This only covers reads
+# served by the same worker, so writes also set STICKY_COOKIE on the response.
+last_write: "OrderedDict[str, float]" = OrderedDict()
+write_lock = threading.Lock()
+
+
+# Signature binding the sticky cookie to the user and its expiry
+def sticky_signature(username: str, until: int) -> str:
+    message = f"{username}:{until}".encode()
+    key = auth.ACCESS_TOKEN_SECRET_KEY.encode()
+    return hmac.new(key, message, hashlib.sha256).hexdigest()
+
+
+# Return bool if the request's sticky cookie pins username to the primary
+def has_sticky_cookie(request: Request, username: str) -> bool:
+    value = request.cookies.get(STICKY_COOKIE, "") if request else ""
+    until, _, signature = value.partition(".")
+    if not until.isdigit() or int(until) < time.time():
+        return False
+    return hmac.compare_digest(signature, sticky_signature(username, int(until)))
+
+
+# Remember a write so the user's next reads see it. With a response, the
+# write is also carried by a signed cookie so every worker honours it.
+def mark_write(username: str, response: Response = None):
+    now = time.monotonic()
+    with write_lock:
+        last_write[username] = now
+        last_write.move_to_end(username)
+        # Drop entries past the window, and the oldest ones beyond the cap
+        while last_write:
+            oldest, at = next(iter(last_write.items()))
+            if now - at < STICKY_SECONDS and len(last_write) <= STICKY_MAX_USERS:
+                break
+            del last_write[oldest]
+
+    if response is not None and engines:
+        until = math.ceil(time.time() + STICKY_SECONDS)
+        response.set_cookie(
+            STICKY_COOKIE,
+            f"{until}.{sticky_signature(username, until)}",
+            max_age=math.ceil(STICKY_SECONDS),
+            httponly=True,
+            samesite="lax",
+        )
+
+
+# Engine for a read. Users who wrote recently and requests made while no
+# replica is healthy use the primary.
+def read_engine(username: str = None, request: Request = None):
+    if not healthy:
+        return database.engine
+    if username:
+        wrote_at = last_write.get(username)
+        if wrote_at and time.monotonic() - wrote_at < STICKY_SECONDS:
+            return database.engine
+        if has_sticky_cookie(request, username):
+            return database.engine
+    return random.choice(healthy)
+
+
+# Session for a read. Reuses the request's primary session when the read
+# is not sent to a replica.
+@contextmanager
+def read_session(session: Session, username: str = None, request: Request = None):
+    engine = read_engine(username, request)
+    if engine is database.engine:
+        yield session
+        return
+
+    with Session(engine) as replica_session:
+        yield replica_session
+
+
+# Return replica lag in seconds, raises if the replica is unreachable
+def replica_lag(engine) -> float:
+    with engine.connect() as conn:
+        if engine.dialect.name != "postgresql":
+            conn.execute(text("SELECT 1"))
+            return 0.0
+        return float(conn.execute(LAG_QUERY).scalar())
+
+
+# Refresh the healthy replica list
+def check_replicas():
+    global healthy
+    ok = []
+    for engine in engines:
+        try:
+            if replica_lag(engine) <= REPLICA_MAX_LAG:
+                ok.append(engine)
+        except Exception:
+            continue
+    healthy = ok
+
+
+def check_loop():
+    while True:
+        check_replicas()
+        time.sleep(REPLICA_CHECK_INTERVAL)
+
+
+# Start the background health checker when replicas are configured
+def start_checker():
+    if engines:
+        threading.Thread(target=check_loop, name="replica-check", daemon=True).start()
@@ -1,4 +1,6 @@
 from pydantic import BaseModel
+from typing import Optional, List
+import datetime
 
 
 # User Schemas
@@ -39,6 +41,8 @@ class DeleteUserRequest(BaseModel):
 class CreateRequest(BaseModel):
     original_url: str
     short_code: str
+    reuse_existing: bool = False
+    expires_at: Optional[datetime.datetime] = None
 
 
 class DeleteRequest(BaseModel):
@@ -48,3 +52,34 @@ class DeleteRequest(BaseModel):
 class UpdateRequest(BaseModel):
     short_code: str
     updated_url: str
+
+
+class BatchDeleteRequest(BaseModel):
+    short_codes: List[str]
+
+
+class BatchUpdateRequest(BaseModel):
+    urls: List[UpdateRequest]
+
+
+class BatchResult(BaseModel):
+    short_code: str
+    status: str
+
+
+class BatchResponse(BaseModel):
+    results: List[BatchResult]
+
+
+class URLResponse(BaseModel):
+    id: int
+    original_url: str
+    short_code: str
+    created_at: datetime.datetime
+    user_id: Optional[int] = None
+    expires_at: Optional[datetime.datetime] = None
+
+
+class UpdateResponse(BaseModel):
+    message: str
+    data: URLResponse
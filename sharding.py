@@ -0,0 +1,94 @@
+from sqlmodel import Session, inspect
+from sqlalchemy.schema import CreateTable
+
+from models import URL
+
+from bisect import bisect
+from dotenv import load_dotenv
+import hashlib
+import os
+
+import database
+
+load_dotenv()
+
+# Shard settings. SHARD_URLS is a comma separated list of name=url pairs,
+# e.g. "a=sqlite:///shard_a.db,b=sqlite:///shard_b.db". Shard names, not urls,
+# place shards on the ring, so a shard can move host without remapping users.
+# Without SHARD_URLS every URL row stays on the primary database.
+SHARD_URLS = os.getenv("SHARD_URLS", "")
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "128"))
+
+
+# Stable 64 bit position on the ring
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+# Parse SHARD_URLS into {name: url}
+def parse_shard_urls(value: str) -> dict:
+    shards = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, sep, url = item.strip().partition("=")
+        if not sep or not name or not url:
+            raise ValueError(f"Invalid shard '{item}', expected name=url")
+        shards[name] = url
+    return shards
+
+
+# Maps user_id to a shard engine with consistent hashing
+class ShardRouter:
+    def __init__(self, engines: dict, vnodes: int = SHARD_VNODES):
+        self.engines = engines
+        ring = sorted(
+            (ring_hash(f"{name}#{i}"), name) for name in engines for i in range(vnodes)
+        )
+        self.ring_keys = [key for key, _ in ring]
+        self.ring_names = [name for _, name in ring]
+
+    # Return bool if URLs live on the primary database, i.e. no shards are
+    # configured. A single configured shard is still a separate database.
+    @property
+    def is_single(self) -> bool:
+        return len(self.engines) == 1 and self.engines.get("primary") is database.engine
+
+    # Name of the shard owning user_id
+    def shard_for(self, user_id: int) -> str:
+        index = bisect(self.ring_keys, ring_hash(str(user_id)))
+        return self.ring_names[index % len(self.ring_names)]
+
+    def engine_for(self, user_id: int):
+        return self.engines[self.shard_for(user_id)]
+
+    # New session on the user's shard, caller closes it
+    def session_for(self, user_id: int) -> Session:
+        return Session(self.engine_for(user_id))
+
+
+# Build the router from SHARD_URLS, falling back to the primary engine
+def create_router(value: str = SHARD_URLS) -> ShardRouter:
+    shards = parse_shard_urls(value)
+    if not shards:
+        return ShardRouter({"primary": database.engine})
+    return ShardRouter(
+        {name: database.create_db_engine(url) for name, url in shards.items()}
+    )
+
+
+router = create_router()
+
+
+# Create the url table on shards that don't have it. Users live on the
+# primary, so shard tables are created without the user foreign key.
+def init_shards():
+    table = URL.__table__
+    for engine in router.engines.values():
+        if inspect(engine).has_table(table.name):
+            database.upgrade_url_table(engine)
+            continue
+        with engine.begin() as conn:
+            conn.execute(CreateTable(table, include_foreign_key_constraints=[]))
+            for index in table.indexes:
+                index.create(conn)
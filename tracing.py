@@ -0,0 +1,274 @@
+from fastapi import Request
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
+import urllib.request
+import functools
+import threading
+import logging
+import secrets
+import random
+import queue
+import time
+import json
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Tracing settings. With TRACE_ENABLED, TRACE_SAMPLE_RATE of requests are
+# traced, plus requests whose W3C traceparent header is marked sampled.
+# Traces are exported as OTLP JSON to TRACE_FILE (one trace per line) and/or
+# TRACE_OTLP_ENDPOINT (an OTLP/HTTP collector, e.g. http://localhost:4318).
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "false").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "urlshorty")
+TRACE_QUEUE_SIZE = 1000
+STATEMENT_MAX_LENGTH = 500
+
+
+# A timed operation within a trace
+class Span:
+    __slots__ = (
+        "trace",
+        "span_id",
+        "parent_id",
+        "name",
+        "start",
+        "end",
+        "attributes",
+        "is_server",
+    )
+
+    def __init__(
+        self, trace, name: str, parent_id: str = None, is_server: bool = False
+    ):
+        self.trace = trace
+        self.is_server = is_server
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = {}
+
+    def finish(self):
+        self.end = time.time_ns()
+        self.trace.spans.append(self)
+
+
+# Spans collected for one sampled request
+class Trace:
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.spans = []
+
+
+# Span currently active in this context, None when the request isn't traced
+current_span: ContextVar = ContextVar("current_span", default=None)
+
+
+# Child span of the current span. Does nothing outside a traced request.
+@contextmanager
+def span(name: str, **attributes):
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(parent.trace, name, parent.span_id)
+    child.attributes.update(attributes)
+    token = current_span.set(child)
+    try:
+        yield child
+    finally:
+        current_span.reset(token)
+        child.finish()
+
+
+# Decorator wrapping every call in a span
+def traced(name: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if current_span.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# ORJSONResponse with body encoding in its own span
+class TracedORJSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        with span("response.encode"):
+            return super().render(content)
+
+
+# Return (trace_id, parent_span_id, sampled) from a W3C traceparent header
+def parse_traceparent(value: str):
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None, False
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None, None, False
+    return parts[1], parts[2], sampled
+
+
+# OTLP JSON value for an attribute
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+# OTLP/HTTP JSON document for a finished trace
+def to_otlp(trace: Trace) -> dict:
+    spans = []
+    for item in trace.spans:
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": item.span_id,
+            "name": item.name,
+            # SPAN_KIND_SERVER for the request span, INTERNAL for the rest
+            "kind": 2 if item.is_server else 1,
+            "startTimeUnixNano": str(item.start),
+            "endTimeUnixNano": str(item.end),
+            "attributes": [
+                {"key": key, "value": otlp_value(value)}
+                for key, value in item.attributes.items()
+            ],
+        }
+        if item.parent_id:
+            otlp_span["parentSpanId"] = item.parent_id
+        spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {
+                            "key": "service.name",
+                            "value": {"stringValue": TRACE_SERVICE_NAME},
+                        }
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": "urlshorty"}, "spans": spans}],
+            }
+        ]
+    }
+
+
+# Finished traces waiting for export, dropped when full
+export_queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+
+
+# Write a trace to TRACE_FILE and/or post it to TRACE_OTLP_ENDPOINT
+def export(trace: Trace):
+    body = json.dumps(to_otlp(trace))
+    if TRACE_FILE:
+        with open(TRACE_FILE, "a") as f:
+            f.write(body + "\n")
+    if TRACE_OTLP_ENDPOINT:
+        request = urllib.request.Request(
+            f"{TRACE_OTLP_ENDPOINT.rstrip('/')}/v1/traces",
+            data=body.encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        urllib.request.urlopen(request, timeout=5).close()
+
+
+def export_loop():
+    while True:
+        trace = export_queue.get()
+        try:
+            export(trace)
+        except Exception:
+            logger.exception("Exporting trace failed")
+
+
+# Span per SQL statement on every engine
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = current_span.get()
+    if parent is None:
+        return
+    child = Span(parent.trace, "db.query", parent.span_id)
+    child.attributes["db.statement"] = statement[:STATEMENT_MAX_LENGTH]
+    child.attributes["db.system"] = conn.dialect.name
+    conn.info.setdefault("trace_spans", []).append(child)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("trace_spans")
+    if spans:
+        spans.pop().finish()
+
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(context):
+    spans = context.connection.info.get("trace_spans") if context.connection else None
+    if spans:
+        child = spans.pop()
+        child.attributes["error"] = True
+        child.finish()
+
+
+# Middleware starting a trace for sampled requests
+async def trace_requests(request: Request, call_next):
+    trace_id, parent_id, sampled = parse_traceparent(
+        request.headers.get("traceparent", "")
+    )
+    if not sampled and random.random() >= TRACE_SAMPLE_RATE:
+        return await call_next(request)
+
+    trace = Trace(trace_id)
+    root = Span(
+        trace, f"{request.method} {request.url.path}", parent_id, is_server=True
+    )
+    token = current_span.set(root)
+    try:
+        response = await call_next(request)
+        root.attributes["http.status_code"] = response.status_code
+    except BaseException:
+        root.attributes["error"] = True
+        raise
+    finally:
+        # Failed requests are exported too, they are the ones worth seeing
+        current_span.reset(token)
+        route = request.scope.get("route")
+        if route:
+            root.name = f"{request.method} {route.path}"
+        root.finish()
+        try:
+            export_queue.put_nowait(trace)
+        except queue.Full:
+            pass
+
+    response.headers["traceparent"] = f"00-{trace.trace_id}-{root.span_id}-01"
+    return response
+
+
+# Start the exporter thread
+def start_exporter():
+    threading.Thread(target=export_loop, name="trace-export", daemon=True).start()
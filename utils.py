@@ -1,5 +1,67 @@
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import datetime
+import hashlib
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
 # Normalise the orignal URL
 def normalize_url(url: str) -> str:
     if not url.startswith(("http://", "https://")):
         return f"https://{url}"
     return url
+
+
+# Canonical form of a URL, used to detect the same destination written
+# differently: case of scheme and host, default port, trailing slash and
+# query parameter order. URLs that can't be parsed, like "http://[abc", are
+# returned stripped so they can still be stored and hashed.
+def canonicalize_url(url: str) -> str:
+    url = url.strip()
+    if not url.lower().startswith(("http://", "https://")):
+        url = f"https://{url}"
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+
+    host = (parts.hostname or "").rstrip(".")
+    if ":" in host:
+        host = f"[{host}]"
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    if parts.username:
+        userinfo = parts.username
+        if parts.password:
+            userinfo = f"{userinfo}:{parts.password}"
+        host = f"{userinfo}@{host}"
+
+    path = parts.path.rstrip("/") or "/"
+    # Sort by key only, repeated keys keep their order since it can matter
+    pairs = parse_qsl(parts.query, keep_blank_values=True)
+    query = urlencode(sorted(pairs, key=lambda pair: pair[0]))
+
+    return urlunsplit((scheme, host, path, query, parts.fragment))
+
+
+# Fixed width hash of the canonical URL
+def url_hash(url: str) -> str:
+    canonical = canonicalize_url(url).encode()
+    return hashlib.blake2b(canonical, digest_size=16).hexdigest()
+
+
+# Current UTC time without tzinfo, as stored in the DB
+def utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+# Convert an aware datetime to naive UTC, naive values are taken as UTC
+def to_utc(value: datetime.datetime) -> datetime.datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)